@@ -0,0 +1,84 @@
+"""
+Détecteur d'anomalies (AnomalyDetector) : délai de détection d'une dérive lente, fausses alertes sur
+bruit stationnaire, débit du détecteur seul puis du worker d'ingestion complet.
+
+    python bench/anomaly_bench.py
+"""
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "tests"))
+from app_loader import load_app  # noqa: E402
+
+app = load_app()
+rng = np.random.default_rng(2)
+
+
+def node1_sample(temp: float, ldr: float) -> dict:
+    return {"temperature": temp, "humidity": 50 + rng.normal(0, 1), "flame": 3000 + rng.normal(0, 30), "ldr": ldr}
+
+
+def drift_detection(n: int = 2000):
+    # 1 Hz : température +0.01 °C/s à partir de t=600 s, LDR -0.5/s à partir de t=1000 s
+    det = app.AnomalyDetector()
+    ts = np.arange(n, dtype=float)
+    temp = 30 + rng.normal(0, 0.3, n)
+    temp[600:] += 0.01 * (ts[600:] - 600)
+    ldr = 2000 + rng.normal(0, 15, n)
+    ldr[1000:] -= 0.5 * (ts[1000:] - 1000)
+    first = {}
+    for i in range(n):
+        anomalies, _ = det.update("node1", ts[i], node1_sample(temp[i], ldr[i]))
+        for field, why in anomalies.items():
+            first.setdefault(field, (i, why))
+    start = {"temperature": 600, "ldr": 1000}
+    for field, (i, why) in sorted(first.items()):
+        delay = f"{i - start[field]} s après le début de la dérive" if field in start else "fausse alerte"
+        print(f"  {field:12s} détectée à t={i} s ({why}) : {delay}")
+
+
+def false_positives(n: int = 20000):
+    det = app.AnomalyDetector()
+    raised = 0
+    for i in range(n):
+        anomalies, changed = det.update("d", float(i), node1_sample(30 + rng.normal(0, 0.3), 2000 + rng.normal(0, 15)))
+        raised += changed and bool(anomalies)
+    print(f"  bruit stationnaire, {n} échantillons : {raised} levées d'alerte")
+
+
+def detector_throughput(n: int = 300000, devices: int = 300):
+    det = app.AnomalyDetector()
+    samples = [node1_sample(x, y) for x, y in zip(rng.normal(30, 0.3, 1000), rng.normal(2000, 15, 1000))]
+    names = [f"n{i}" for i in range(devices)]
+    t = time.perf_counter()
+    for i in range(n):
+        det.update(names[i % devices], i * 0.003, samples[i % 1000])
+    el = time.perf_counter() - t
+    print(f"  détecteur seul : {el / n * 1e6:.2f} µs/msg -> {n / el:,.0f} msg/s ({devices} devices x 4 champs)")
+
+
+def ingest_throughput(n: int = 50000, devices: int = 300):
+    # décodage + routeur + règles + anomalies + flotte, sans broker
+    mgr = app.MqttManager("127.0.0.1", 1)
+    samples = [json.dumps(node1_sample(x, y)).encode() for x, y in zip(rng.normal(30, 0.3, 1000), rng.normal(2000, 15, 1000))]
+    now = time.time()
+    msgs = [(f"esp32/n{i % devices}/data", samples[i % 1000], now + i * 1e-3) for i in range(n)]
+    t = time.perf_counter()
+    for i in range(0, n, app.MQTT_INGEST_BATCH):
+        mgr._apply(msgs[i:i + app.MQTT_INGEST_BATCH])
+    el = time.perf_counter() - t
+    print(f"  worker d'ingestion complet : {n} msgs en {el:.2f}s -> {n / el:,.0f} msg/s")
+
+
+if __name__ == "__main__":
+    print("Dérive lente (1 Hz, bruit 0.3 °C / 15 ADC) :")
+    drift_detection()
+    print("Fausses alertes :")
+    false_positives()
+    print("Débit :")
+    detector_throughput()
+    ingest_throughput()
@@ -0,0 +1,71 @@
+"""
+Moteurs MQTT "thread" (loop_start) et "asyncio" : débit et latence publication -> on_message du manager.
+Nécessite un broker (ex. mosquitto ou amqtt en local) ; un publisher paho envoie esp32/bench/data.
+
+    python bench/mqtt_engine_bench.py --engine asyncio --count 5000            # rafale
+    python bench/mqtt_engine_bench.py --engine thread --count 5000 --rate 500  # cadencé (msg/s)
+"""
+import argparse
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import paho.mqtt.client as mqtt
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "tests"))
+from app_loader import load_app  # noqa: E402
+
+STAMP = 18  # horodatage d'envoi en tête de payload
+
+
+def run(engine: str, host: str, port: int, count: int, rate: float):
+    app = load_app()
+    cls = app.AsyncMqttManager if engine == "asyncio" else app.MqttManager
+    mgr = cls(host, port)
+    lat = []
+    done = threading.Event()
+    on_message = mgr._on_message
+
+    def timed(client, userdata, msg):
+        lat.append(time.time() - float(msg.payload[:STAMP]))
+        on_message(client, userdata, msg)
+        if len(lat) >= count:
+            done.set()
+
+    for client, *_ in getattr(mgr, "brokers", [(mgr.client,)]):
+        client.on_message = timed
+    mgr.start()
+    while not mgr.state.connected:
+        time.sleep(0.05)
+    time.sleep(0.5)  # abonnement en place
+
+    pub = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    pub.connect(host, port)
+    pub.loop_start()
+    t = time.time()
+    for _ in range(count):
+        pub.publish("esp32/bench/data", f"{time.time():.6f}".ljust(STAMP).encode() + b'{"temperature": 21.5}')
+        if rate:
+            time.sleep(1 / rate)
+    done.wait(60)
+    el = time.time() - t
+    pub.loop_stop()
+
+    ms = np.array(lat) * 1e3
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    print(f"{engine:8s} n={count} cadence={rate or 'max'} : {len(lat) / el:7.0f} msg/s • "
+          f"latence p50 {p50:.2f} ms / p95 {p95:.2f} ms / p99 {p99:.2f} ms")
+    print("threads :", ", ".join(sorted(th.name for th in threading.enumerate())))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--engine", choices=["thread", "asyncio"], default="thread")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--count", type=int, default=5000)
+    parser.add_argument("--rate", type=float, default=0, help="msg/s, 0 = rafale")
+    args = parser.parse_args()
+    run(args.engine, args.host, args.port, args.count, args.rate)
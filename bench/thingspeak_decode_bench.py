@@ -0,0 +1,76 @@
+"""
+Décodage ThingSpeak (octets JSON -> DataFrame) : ancien décodage ligne par ligne contre decode_feeds,
+avec json et orjson (si installé). Moyenne de REPS exécutions, pic mémoire tracemalloc.
+
+    python bench/thingspeak_decode_bench.py
+"""
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "tests"))
+from app_loader import load_app  # noqa: E402
+
+app = load_app()
+REPS = 20
+T0 = pd.Timestamp("2026-01-01", tz="UTC")
+
+
+def synthetic_feeds(n: int, step_s: int = 15) -> bytes:
+    feeds = [
+        {
+            "created_at": (T0 + pd.Timedelta(seconds=i * step_s)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "entry_id": i + 1,
+            "field1": f"{20 + i % 30:.2f}",
+            "field2": "55",
+            "field3": str(1000 + i * 7 % 3000),
+            "field4": str(i % 4096),
+            "status": "ESP32_Data",
+        }
+        for i in range(n)
+    ]
+    return json.dumps({"channel": {"id": 1}, "feeds": feeds}).encode()
+
+
+def decode_per_row(raw: bytes) -> pd.DataFrame:
+    # décodage d'avant decode_feeds : un dict par ligne puis conversions colonne par colonne
+    rows = []
+    for f in json.loads(raw).get("feeds", []):
+        rows.append({"entry_id": f.get("entry_id"), "created_at": f.get("created_at"), "temp": f.get("field1"),
+                     "humidity": f.get("field2"), "flame": f.get("field3"), "ldr": f.get("field4"),
+                     "status": f.get("status")})
+    df = pd.DataFrame(rows)
+    df["created_at"] = pd.to_datetime(df["created_at"], errors="coerce")
+    for c in ["temp", "humidity", "flame", "ldr"]:
+        df[c] = pd.to_numeric(df[c], errors="coerce")
+    return df.dropna(subset=["created_at"]).sort_values("created_at")
+
+
+def measure(fn, raw: bytes):
+    fn(raw)
+    t = time.perf_counter()
+    for _ in range(REPS):
+        fn(raw)
+    ms = (time.perf_counter() - t) / REPS * 1e3
+    tracemalloc.start()
+    fn(raw)
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return f"{ms:6.1f} ms {peak:5.2f} MB"
+
+
+if __name__ == "__main__":
+    decoders = {
+        "ligne par ligne": decode_per_row,
+        "decode_feeds (json)": lambda raw: app.decode_feeds(json.loads(raw)["feeds"]),
+    }
+    if app.orjson is not None:
+        decoders["decode_feeds (orjson)"] = lambda raw: app.decode_feeds(app.orjson.loads(raw)["feeds"])
+    print(f"{'entrées':>7} | " + " | ".join(f"{name:22s}" for name in decoders))
+    for n in (180, 2000, app.TS_PAGE_MAX):
+        raw = synthetic_feeds(n)
+        print(f"{n:>7} | " + " | ".join(f"{measure(fn, raw):22s}" for fn in decoders.values()))
@@ -4,6 +4,7 @@ import threading
 from dataclasses import dataclass
 
 import requests
+import altair as alt
 import pandas as pd
 import streamlit as st
 import paho.mqtt.client as mqtt
@@ -244,6 +245,34 @@ def kpi_card(title, value, unit="", level="ok"):
     )
 
 
+def trends_chart(df, series):
+    """
+    Un seul graphe pour toutes les séries :
+    - données "larges" (created_at + 1 colonne/série) -> timestamps sérialisés une seule fois,
+      le dépliage en lignes est fait côté navigateur (transform_fold)
+    - une ligne par série, axe X partagé (zoom/pan liés), axe Y indépendant par série
+    series : [(colonne, légende), ...]
+    """
+    labels = [label for _, label in series]
+    data = df[["created_at"] + [c for c, _ in series]].rename(columns=dict(series))
+    zoom = alt.selection_interval(bind="scales", encodings=["x"])
+
+    return (
+        alt.Chart(data)
+        .transform_fold(labels, as_=["serie", "valeur"])
+        .mark_line()
+        .encode(
+            x=alt.X("created_at:T", title=None),
+            y=alt.Y("valeur:Q", title=None, scale=alt.Scale(zero=False)),
+            color=alt.Color("serie:N", legend=None, sort=labels),
+        )
+        .properties(height=140, width=900)
+        .add_params(zoom)
+        .facet(row=alt.Row("serie:N", title=None, sort=labels))
+        .resolve_scale(y="independent")
+    )
+
+
 def gauge_card(title, value_num, vmin, vmax, level="ok", left_label="", right_label=""):
     # normalize
     try:
@@ -629,8 +658,8 @@ elif page == "Controls":
         with b4:
             if st.button("Quick Move (180→90)", use_container_width=True):
                 mqtt_mgr.publish(TOPIC_SERVO_CMD, "180")
-                time.sleep(0.25)
-                mqtt_mgr.publish(TOPIC_SERVO_CMD, "90")
+                # 2e position publiée par un timer : le script ne dort pas
+                threading.Timer(0.25, mqtt_mgr.publish, (TOPIC_SERVO_CMD, "90")).start()
                 st.toast("Servo mouvement envoyé")
 
     with right:
@@ -702,21 +731,12 @@ elif page == "ThingSpeak":
                     kpi_card("LDR", f"{int(last['ldr']) if pd.notna(last['ldr']) else '—'}", "", "ok")
 
             st.markdown("### 📈 Trends")
-            left, right = st.columns(2)
-            with left:
-                st.caption("Temperature")
-                st.line_chart(df.set_index("created_at")[["temp"]])
-            with right:
-                st.caption("Humidity")
-                st.line_chart(df.set_index("created_at")[["humidity"]])
-
-            left2, right2 = st.columns(2)
-            with left2:
-                st.caption("Flame (ADC)")
-                st.line_chart(df.set_index("created_at")[["flame"]])
-            with right2:
-                st.caption("LDR (ADC)")
-                st.line_chart(df.set_index("created_at")[["ldr"]])
+            st.altair_chart(
+                trends_chart(
+                    df,
+                    [("temp", "Temperature"), ("humidity", "Humidity"), ("flame", "Flame (ADC)"), ("ldr", "LDR (ADC)")],
+                )
+            )
 
             with st.expander("Voir table (dernieres lignes)"):
                 st.dataframe(df.tail(20), use_container_width=True)
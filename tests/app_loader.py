@@ -0,0 +1,36 @@
+import ast
+import types
+from pathlib import Path
+
+APP_PATH = Path(__file__).resolve().parent.parent / "streamlit-app-v2.py"
+
+# valeurs lues dans st.secrets / la page au chargement normal de l'app
+APP_DEFAULTS = {
+    "RULES_CONFIG": [],
+    "MQTT_CMD_QOS": 1,
+    "MQTT_BACKPRESSURE": "drop_oldest",
+    "FAILSAFE_ENABLED": True,
+    "TS_API_URL": "https://api.thingspeak.com",
+}
+
+
+def load_app(path: Path = APP_PATH) -> types.ModuleType:
+    """
+    Charge les définitions de l'app (imports, fonctions, classes, constantes) sans exécuter la page :
+    le script Streamlit dessine et démarre ses threads au niveau module.
+    """
+    src = path.read_text(encoding="utf-8")
+    mod = types.ModuleType("app")
+    mod.__dict__.update(APP_DEFAULTS)
+    for node in ast.parse(src).body:
+        if isinstance(node, ast.Assign):
+            seg = ast.get_source_segment(src, node)
+            if "st." in seg or "get_" in seg or "mqtt_mgr" in seg:
+                continue  # secrets, ressources partagées, widgets
+        elif not isinstance(node, (ast.Import, ast.ImportFrom, ast.Try, ast.ClassDef, ast.FunctionDef)):
+            continue
+        try:
+            exec(compile(ast.Module([node], []), str(path), "exec"), mod.__dict__)
+        except NameError:
+            pass  # variable de la page (dépend d'un widget ou d'un snapshot)
+    return mod
@@ -0,0 +1,19 @@
+import pandas as pd
+
+
+def feed(entry_id: int, **fields) -> dict:
+    return {"entry_id": entry_id, "created_at": f"2026-01-01T00:00:{entry_id:02d}Z", "status": "ESP32_Data", **fields}
+
+
+def test_out_of_range_int_field_is_na(app):
+    df = app.decode_feeds([
+        feed(1, field1="21.5", field3="4000", field4="1200"),
+        feed(2, field1="22", field3="40000", field4="-70000"),
+        feed(3, field1="abc", field3=None, field4="12.6"),
+    ])
+
+    assert df["entry_id"].tolist() == [1, 2, 3]
+    assert str(df["flame"].dtype) == "Int16"
+    assert df["flame"].tolist() == [4000, pd.NA, pd.NA]
+    assert df["ldr"].tolist() == [1200, pd.NA, 13]
+    assert pd.isna(df["temp"].iloc[2])
@@ -0,0 +1,51 @@
+import json
+import time
+from types import SimpleNamespace
+
+import paho.mqtt.client as mqtt
+import pytest
+
+
+@pytest.fixture
+def mgr(app):
+    return app.MqttManager("127.0.0.1", 1)  # jamais démarré : pas de réseau ni de threads
+
+
+def deliver(mgr, topic: str, payload: dict):
+    # comme le broker : une copie du message par souscription qui couvre le topic
+    msg = SimpleNamespace(topic=topic, payload=json.dumps(payload).encode())
+    for topic_filter, _ in mgr.router.subscriptions():
+        if mqtt.topic_matches_sub(topic_filter, topic):
+            mgr._on_message(None, None, msg)
+    mgr._apply(mgr.ingest.get_batch(100, block=False))
+
+
+def test_status_subscribed_once(app, mgr):
+    filters = [f for f, _ in mgr.router.subscriptions()]
+    assert app.TOPIC_FLEET_STATUS in filters
+    assert app.TOPIC_STATUS not in filters  # couvert par +/status
+
+
+def test_one_status_publish_handled_once(app, mgr, monkeypatch):
+    calls = []
+    on_status = mgr.commands.on_status
+    monkeypatch.setattr(mgr.commands, "on_status", lambda data, ts: calls.append(data) or on_status(data, ts))
+
+    deliver(mgr, app.TOPIC_STATUS, {"motors": "ON", "servo_angle": 90, "led": "OFF"})
+    deliver(mgr, "esp32_7/status", {"motors": "OFF"})
+
+    assert len(calls) == 1
+    assert mgr.processed == 2
+    fleet = mgr.fleet.to_frame(time.time()).set_index("device")["messages"]
+    assert fleet.to_dict() == {"esp32_2": 1, "esp32_7": 1}
+
+
+def test_kpi_window_expires_while_fleet_publishes(app, mgr):
+    mgr.kpi = app.WindowAggregates({"1 s": 1.0})
+    deliver(mgr, app.TOPIC_NODE1_DATA, {"temperature": 25.0})
+    assert mgr.state.node1_kpi["temperature"]["1 s"].count == 1
+
+    # Node #1 silencieux, la flotte publie : le worker ne passe jamais par _tick()
+    time.sleep(1.2)
+    deliver(mgr, "esp32/n1/data", {"temperature": 30.0})
+    assert mgr.state.node1_kpi["temperature"]["1 s"] is None
@@ -0,0 +1,192 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import pytest
+
+T0 = pd.Timestamp("2026-01-01 00:00:00", tz="UTC")
+TS_FMT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+class FakeThingSpeak(ThreadingHTTPServer):
+    """
+    feeds.json (start/end inclus, results = les plus récentes, comme ThingSpeak) et feeds/last.json (ETag / 304).
+    too_many : nb de réponses 429 (Retry-After) renvoyées avant de servir feeds.json.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, entries: int, period_s: int = 60):
+        super().__init__(("127.0.0.1", 0), FakeHandler)
+        self.feeds = [self.entry(i + 1, T0 + pd.Timedelta(seconds=i * period_s)) for i in range(entries)]
+        self.too_many = 0
+        self.retry_after = "0.2"
+        self.requests = []  # (chemin, paramètres, statut)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def entry(entry_id: int, ts: pd.Timestamp) -> dict:
+        return {"entry_id": entry_id, "created_at": ts.strftime(TS_FMT), "field1": "21.5", "field2": "40",
+                "field3": "4000", "field4": "1200", "status": "ESP32_Data"}
+
+    def etag(self) -> str:
+        return f'"{self.feeds[-1]["entry_id"]}"' if self.feeds else '"-1"'
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        q = {k: v[0] for k, v in parse_qs(url.query).items()}
+        srv = self.server
+        if url.path.endswith("/feeds/last.json"):
+            if self.headers.get("If-None-Match") == srv.etag():
+                return self.reply(url.path, q, 304)
+            return self.reply(url.path, q, 200, srv.feeds[-1] if srv.feeds else -1, {"ETag": srv.etag()})
+        with srv.lock:
+            limited = srv.too_many > 0
+            srv.too_many -= limited
+        if limited:
+            return self.reply(url.path, q, 429, {"status": "429"}, {"Retry-After": srv.retry_after})
+        feeds = srv.feeds
+        if "start" in q:
+            start = pd.Timestamp(q["start"], tz="UTC")
+            feeds = [f for f in feeds if pd.Timestamp(f["created_at"]) >= start]
+        if "end" in q:
+            end = pd.Timestamp(q["end"], tz="UTC")
+            feeds = [f for f in feeds if pd.Timestamp(f["created_at"]) <= end]
+        feeds = feeds[-int(q.get("results", 8000)):]
+        self.reply(url.path, q, 200, {"channel": {"id": 1}, "feeds": feeds})
+
+    def reply(self, path, params, status, body=None, headers=None):
+        with self.server.lock:
+            self.server.requests.append((path, params, status))
+        data = b"" if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def ts_server(app, monkeypatch):
+    servers = []
+
+    def start(entries: int, **kw) -> FakeThingSpeak:
+        srv = FakeThingSpeak(entries, **kw)
+        threading.Thread(target=srv.serve_forever, args=(0.05,), daemon=True).start()
+        servers.append(srv)
+        monkeypatch.setattr(app, "TS_API_URL", f"http://127.0.0.1:{srv.server_address[1]}")
+        return srv
+
+    yield start
+    for srv in servers:
+        srv.shutdown()
+        srv.server_close()
+
+
+def feed_requests(srv: FakeThingSpeak) -> list:
+    return [r for r in srv.requests if r[0].endswith("/feeds.json")]
+
+
+def backfill(app, srv, hours: float, **kw):
+    kw.setdefault("workers", 4)
+    return app.backfill_thingspeak("1", "", T0, T0 + pd.Timedelta(hours=hours), session=app.new_thingspeak_session(),
+                                   limiter=app.RateLimiter(0), **kw)
+
+
+def test_backfill_splits_full_windows(app, ts_server, monkeypatch):
+    monkeypatch.setattr(app, "TS_PAGE_MAX", 50)
+    srv = ts_server(600)  # 10 h à 1 msg/min
+    df = backfill(app, srv, 10, slice_s=5 * 3600)
+
+    assert df["entry_id"].tolist() == list(range(1, 601))
+    # 2 fenêtres de 300 entrées, pleines (50) : coupées en deux jusqu'à passer sous TS_PAGE_MAX
+    windows = [(r[1]["start"], r[1]["end"]) for r in feed_requests(srv)]
+    assert len(windows) > 2 and len(set(windows)) == len(windows)
+
+
+def test_backfill_waits_retry_after_on_429(app, ts_server):
+    srv = ts_server(120)
+    srv.too_many = 3
+    t = time.monotonic()
+    df = backfill(app, srv, 2, slice_s=3600, workers=2)
+
+    assert df["entry_id"].tolist() == list(range(1, 121))
+    assert [r[2] for r in feed_requests(srv)].count(429) == 3
+    assert time.monotonic() - t >= float(srv.retry_after)  # pause partagée du RateLimiter
+
+
+def test_backfill_gives_up_after_retries(app, ts_server, monkeypatch):
+    monkeypatch.setattr(app, "TS_BACKFILL_RETRIES", 1)
+    srv = ts_server(60)
+    srv.too_many = 10
+    srv.retry_after = "0"
+    with pytest.raises(app.requests.HTTPError):
+        backfill(app, srv, 1, slice_s=3600, workers=1)
+
+
+def test_backfill_dedups_window_bounds_and_orders(app, ts_server):
+    # une entrée pile sur chaque borne de fenêtre : end ThingSpeak inclus -> renvoyée par deux fenêtres
+    srv = ts_server(180, period_s=600)
+    srv.feeds.reverse()  # ordre de réponse quelconque
+    df = backfill(app, srv, 30, slice_s=3600)
+
+    assert df["entry_id"].tolist() == list(range(1, 181))
+    assert df["created_at"].is_monotonic_increasing
+    assert df["entry_id"].is_unique
+
+
+def test_last_json_conditional_probe(app, ts_server):
+    srv = ts_server(10)
+    session = app.new_thingspeak_session()
+
+    entry_id, validators = app.fetch_thingspeak_last("1", "", session)
+    assert entry_id == 10 and validators["ETag"] == '"10"'
+
+    # rien de nouveau : 304 sans corps, validateurs conservés
+    assert app.fetch_thingspeak_last("1", "", session, validators) == (None, validators)
+    assert srv.requests[-1][2] == 304
+
+    srv.feeds.append(srv.entry(11, T0 + pd.Timedelta(minutes=10)))
+    entry_id, validators = app.fetch_thingspeak_last("1", "", session, validators)
+    assert entry_id == 11 and validators["ETag"] == '"11"'
+
+
+def test_stale_read_does_not_cut_error_backoff(app):
+    poller = app.ThingSpeakPoller("1", "")  # jamais démarré
+    poller.state = app.ThingSpeakState(ts_try=time.time() - 10 * poller.interval_s, error="HTTP 500")
+    poller._failures = 2
+    poller.snapshot()
+    assert not poller._wake.is_set()
+
+    poller._failures = 0
+    poller.snapshot()
+    assert poller._wake.is_set()
+
+
+def test_incremental_refresh_fills_gap_after_full_page(app, ts_server, monkeypatch):
+    monkeypatch.setattr(app, "TS_PAGE_MAX", 50)
+    srv = ts_server(20)
+    poller = app.ThingSpeakPoller("1", "")  # jamais démarré : _refresh() appelé à la main
+    poller.limiter = app.RateLimiter(0)
+    poller._refresh()
+    assert poller.state.df["entry_id"].tolist() == list(range(1, 21))
+
+    # coupure : 200 nouvelles entrées, la requête incrémentale ne renvoie que les 50 plus récentes
+    for i in range(21, 221):
+        srv.feeds.append(srv.entry(i, T0 + pd.Timedelta(minutes=i - 1)))
+    poller._refresh()
+
+    assert poller.state.error is None
+    assert poller.state.df["entry_id"].tolist() == list(range(1, 221))
+    incremental = [r for r in feed_requests(srv) if "end" not in r[1]][-1]
+    assert incremental[1]["results"] == "50"